@@ -0,0 +1,84 @@
+"""Read throughput of ``Database`` with and without read replicas.
+
+Reader threads run ``Database.get`` against one SQLite file, or round-robin across
+replica copies, while a writer thread keeps inserting into the primary.
+
+Expect one large step from 0 to 1 replica and little change after it: the gain comes
+from moving reads off the file the writer keeps locking and committing to, and from
+``immutable=1`` skipping file locking on the copies. Reader threads share the GIL, so
+adding replicas does not add read parallelism in this benchmark; in a prefork
+deployment each worker process would hold its own connections.
+
+Usage: python benchmarks/replica_reads.py [--readers 4] [--seconds 3] [--rows 10000]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from sixi_web import Column, Database, Table
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+
+
+def populate(path, rows):
+    db = Database(path)
+    db.create(Author)
+    db.conn.executemany("INSERT INTO author (name, age) VALUES (?, ?)", [(f"author{i}", i % 90) for i in range(rows)])
+    db.conn.commit()
+    db.conn.close()
+
+
+def run(primary, replicas, readers, seconds, rows):
+    stop = threading.Event()
+    counts = [0] * readers
+
+    def read(index):
+        db = Database(primary, replicas=replicas, immutable_replicas=True)
+        id = index
+        while not stop.is_set():
+            id = (id + 7919) % rows
+            db.get(Author, id + 1)
+            counts[index] += 1
+
+    def write():
+        db = Database(primary)
+        while not stop.is_set():
+            db.save(Author(name="writer", age=1))
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        primary = os.path.join(tmp, "primary.db")
+        populate(primary, args.rows)
+        for replica_count in (0, 1, 2, 4):
+            replicas = []
+            for i in range(replica_count):
+                replicas.append(os.path.join(tmp, f"replica{i}.db"))
+                shutil.copy(primary, replicas[-1])
+            reads = run(primary, replicas, args.readers, args.seconds, args.rows)
+            print(f"replicas={replica_count} readers={args.readers}: {reads:,.0f} reads/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,19 @@
 __version__ = "0.1.4"
 
 from .api import API
-from .middleware import Middleware
-from .orm import Column, Database, ForeignKey, Table  # noqa
+from .background import BackgroundTasks
+from .middleware import LoadSheddingMiddleware, Middleware
+from .request import Request, UploadedFile
 
-__all__ = ["API", "Middleware", "Database" "Table", "Column", "ForeignKey"]
+__all__ = ["API", "Middleware", "LoadSheddingMiddleware", "BackgroundTasks", "Request", "UploadedFile", "Database", "Table", "Column", "ForeignKey", "Cache", "AsyncDatabase"]
+
+_LAZY_ORM = {"AsyncDatabase", "Cache", "Column", "Database", "ForeignKey", "Table"}
+
+
+def __getattr__(name):
+    """Import the ORM on first use, keeping ``import sixi_web`` light."""
+    if name in _LAZY_ORM:
+        from . import orm
+
+        return getattr(orm, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,28 @@
+"""Sixi web framework - command line interface.
+
+Usage: python -m sixi_web serve module:app [--bind HOST:PORT] [--workers N] [--max-requests N]
+"""
+import argparse
+import sys
+
+from .server import Arbiter
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sixi_web")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run an app with the prefork server")
+    serve.add_argument("app", help="application to serve, as module:attribute")
+    serve.add_argument("--bind", default="127.0.0.1:8000", help="address to listen on (default: %(default)s)")
+    serve.add_argument("--workers", type=int, default=2, help="number of worker processes (default: %(default)s)")
+    serve.add_argument("--max-requests", type=int, default=0, help="recycle a worker after this many requests, 0 to disable")
+
+    args = parser.parse_args(argv)
+    host, _, port = args.bind.rpartition(":")
+    sys.path.insert(0, "")
+    Arbiter(args.app, host=host or "127.0.0.1", port=int(port), workers=args.workers, max_requests=args.max_requests).run()
+
+
+if __name__ == "__main__":
+    main()
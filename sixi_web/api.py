@@ -1,36 +1,52 @@
 """Sixi web framework - API class."""
+import gc
 import inspect
 import os
 from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
-from jinja2 import Environment, FileSystemLoader
-from parse import parse
-from requests import Session as RequestsSession
-from webob import Request
-from webob.exc import HTTPNotFound
-from whitenoise import WhiteNoise
-from wsgiadapter import WSGIAdapter as RequestsWSGIAdapter
+from parse import compile as compile_rule
+from webob.exc import HTTPException, HTTPNotFound, HTTPRequestEntityTooLarge
 
+from .background import BACKGROUND_KEY, BackgroundTasks
+from .deadline import DeadlineExceeded, DeadlineStats, deadline, remaining
 from .middleware import Middleware
-from .response import Response
+from .request import DEFAULT_SPOOL_THRESHOLD, MAX_BODY_SIZE_KEY, SPOOL_THRESHOLD_KEY, Request
+from .response import AUTO_ETAG_KEY, Response
+from .singleflight import COALESCE_METHODS, SingleFlight
 
+ROUTE_KEY = "sixi_web.route"
 F = TypeVar("F", bound=Callable[..., Any])
 VF_ARGS = TypeVar("VF_ARGS", bound=Tuple[Optional[Callable], Optional[Dict]])
 
 
 class API:
-    def __init__(self, templates_dir=None, static_dir=None):
+    def __init__(self, templates_dir=None, static_dir=None, max_body_size=None, spool_threshold=DEFAULT_SPOOL_THRESHOLD, auto_etag=True, timeout=None, background_tasks=None):
+        """``background_tasks`` is the ``BackgroundTasks`` pool running ``resp.background`` tasks, e.g.
+        ``BackgroundTasks(workers=8, max_queue=100, policy="drop")``; a default pool is created when omitted.
+        """
         self.routes = {}
+        self.mounts = {}
         self.error_handlers = {}
         self.templates_env = None
         self.whitenoise = None
+        self.max_body_size = max_body_size
+        self.spool_threshold = spool_threshold
+        self.auto_etag = auto_etag
+        self.timeout = timeout
+        self.deadline_stats = DeadlineStats()
 
         if templates_dir:
+            from jinja2 import Environment, FileSystemLoader
+
             self.templates_env = Environment(loader=FileSystemLoader(os.path.abspath(templates_dir)), autoescape=True)
         if static_dir:
+            from whitenoise import WhiteNoise
+
             self.whitenoise = WhiteNoise(self.wsgi_app, root=static_dir)
 
         self.middleware = Middleware(self)
+        self.background_tasks = BackgroundTasks() if background_tasks is None else background_tasks
+        self.single_flight = SingleFlight()
 
     def __call__(self, environ, start_response):
         path_info = environ["PATH_INFO"]
@@ -38,6 +54,23 @@ class API:
             environ["PATH_INFO"] = path_info[len("/static") :]
             return self.whitenoise(environ, start_response)
 
+        if self.mounts:
+            segment = path_info[1:].partition("/")[0]
+            app = self.mounts.get(segment)
+            if app is not None:
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + "/" + segment
+                environ["PATH_INFO"] = path_info[len(segment) + 1 :] or "/"
+                return app(environ, start_response)
+
+        environ[MAX_BODY_SIZE_KEY] = self.max_body_size
+        environ[SPOOL_THRESHOLD_KEY] = self.spool_threshold
+        environ[BACKGROUND_KEY] = self.background_tasks
+        environ[AUTO_ETAG_KEY] = self.auto_etag
+        try:
+            Request(environ).check_body_size()
+        except HTTPRequestEntityTooLarge as e:
+            return e(environ, start_response)
+
         return self.middleware(environ, start_response)
 
     def wsgi_app(self, environ, start_response):
@@ -53,43 +86,95 @@ class API:
         """Find matching view function and parse parameters."""
 
         for rule, view_func_data in self.routes.items():
-            result = parse(rule, path)
+            parser = view_func_data.get("parser")
+            if parser is None:
+                parser = view_func_data["parser"] = compile_rule(rule)
+            result = parser.parse(path)
             if result is not None:
                 return view_func_data, result.named
         return None, None
 
+    def match(self, req: Request) -> VF_ARGS:
+        """``find_view_and_kwargs`` for ``req.path_info``, cached in the environ so middleware can share it."""
+        cached = req.environ.get(ROUTE_KEY)
+        if cached is None or cached[0] != req.path_info:
+            cached = req.environ[ROUTE_KEY] = (req.path_info, self.find_view_and_kwargs(req.path_info))
+        return cached[1]
+
+    def warmup(self) -> None:
+        """Do the lazy per-process work up front, e.g. before forking workers.
+
+        Compiles every route rule and template, then moves everything allocated so far
+        into the permanent GC generation so forked children keep sharing those pages.
+        """
+        for rule, view_func_data in self.routes.items():
+            if "parser" not in view_func_data:
+                view_func_data["parser"] = compile_rule(rule)
+        if self.templates_env:
+            for template_name in self.templates_env.list_templates():
+                self.templates_env.get_template(template_name)
+        for app in self.mounts.values():
+            if isinstance(app, API):
+                app.warmup()
+        gc.collect()
+        gc.freeze()
+
     def despatch_request(self, req: Request) -> Response:
-        resp = Response()
-        view_func_data, kwargs = self.find_view_and_kwargs(path=req.path)
+        view_func_data, kwargs = self.match(req)
 
-        if view_func_data is not None:
+        if view_func_data is None:
+            return HTTPNotFound()
 
-            view_func = view_func_data["view_func"]
-            allowed_methods = view_func_data["allowed_methods"]
-            if inspect.isclass(view_func):
-                view_func = getattr(view_func(), req.method.lower(), None)
-                if not view_func:
-                    raise AttributeError(f"Method not allowed: {req.method}")
+        view_func = view_func_data["view_func"]
+        allowed_methods = view_func_data["allowed_methods"]
+        if inspect.isclass(view_func):
+            view = view_func()
+            view_func = getattr(view, req.method.lower(), None)
+            if view_func is None and req.method == "HEAD":
+                view_func = getattr(view, "get", None)
+            if not view_func:
+                raise AttributeError(f"Method not allowed: {req.method}")
+        else:
+            if req.method.lower() not in allowed_methods:
+                raise AttributeError(f"Method not allowed: {req.method}")
+
+        timeout = view_func_data.get("timeout") or self.timeout
+        with deadline(timeout):
+            if view_func_data.get("coalesce") and req.method in COALESCE_METHODS:
+                key = SingleFlight.key(req, view_func_data["vary"])
+                resp = self.single_flight.do(key, lambda: self.call_view(req, view_func, kwargs), view_func_data["coalesce_timeout"])
             else:
-                if req.method.lower() not in allowed_methods:
-                    raise AttributeError(f"Method not allowed: {req.method}")
-
-            try:
-                view_func(req, resp, **kwargs)
-            except Exception as e:
-                error_handler = self.error_handlers.get(e.__class__)
-                if error_handler:
-                    error_handler(req, resp, e)
-                else:
-                    raise e
+                resp = self.call_view(req, view_func, kwargs)
+            if timeout is not None:
+                self.deadline_stats.record(remaining(), isinstance(resp, DeadlineExceeded))
+        return resp
 
-        else:
-            return HTTPNotFound()
+    def call_view(self, req: Request, view_func: Callable, kwargs: Dict) -> Response:
+        resp = Response()
+        try:
+            view_func(req, resp, **kwargs)
+        except Exception as e:
+            error_handler = self.error_handlers.get(e.__class__)
+            if error_handler:
+                error_handler(req, resp, e)
+            elif isinstance(e, HTTPException):
+                return e
+            else:
+                raise e
 
         return resp
 
-    def add_route(self, rule: str, view_func: F, allowed_methods: List[str] = None) -> None:
-        """Add route entrypoint."""
+    def add_route(
+        self, rule: str, view_func: F, allowed_methods: List[str] = None, coalesce: bool = False, vary: List[str] = None, coalesce_timeout: float = 5.0, timeout: float = None
+    ) -> None:
+        """Add route entrypoint.
+
+        With ``coalesce``, concurrent GET/HEAD requests with the same path, query string
+        and ``vary`` header values share one view execution, waiting up to
+        ``coalesce_timeout`` seconds for it. ``timeout`` overrides the API-wide request
+        deadline; ORM queries past it are interrupted and the request gets a 504.
+        HEAD is allowed wherever GET is.
+        """
         _existed_view_func_data = self.routes.get(rule)
         if _existed_view_func_data:
             _existed_view_func = _existed_view_func_data["view_func"]
@@ -97,19 +182,46 @@ class API:
             msg += f"\n- {view_func.__module__}.{view_func.__name__}"
             raise AssertionError(msg)
         if allowed_methods is None and inspect.isfunction(view_func):
-            allowed_methods = "get post put patch delete options".split()
-        self.routes[rule] = {"view_func": view_func, "allowed_methods": allowed_methods}
-
-    def route(self, rule: str, allowed_methods: List[str] = None) -> F:
+            allowed_methods = "get head post put patch delete options".split()
+        elif allowed_methods is not None and "get" in allowed_methods and "head" not in allowed_methods:
+            allowed_methods = [*allowed_methods, "head"]
+        self.routes[rule] = {
+            "rule": rule,
+            "view_func": view_func,
+            "allowed_methods": allowed_methods,
+            "coalesce": coalesce,
+            "vary": tuple(vary or ()),
+            "coalesce_timeout": coalesce_timeout,
+            "timeout": timeout,
+        }
+
+    def mount(self, prefix: str, app: Callable) -> None:
+        """Dispatch every request under ``prefix`` (one path segment, e.g. "/admin") to ``app``.
+
+        ``app`` is another ``API`` with its own routes, middleware and error handlers, or
+        any WSGI application; it sees the prefix moved from ``PATH_INFO`` to ``SCRIPT_NAME``.
+        """
+        segment = prefix.strip("/")
+        if not segment or "/" in segment:
+            raise ValueError(f"Mount prefix must be a single path segment: {prefix}")
+        _existed_app = self.mounts.get(segment)
+        if _existed_app:
+            raise AssertionError(f"Cannot mount {app} at {prefix}, already mounted: {_existed_app}")
+        self.mounts[segment] = app
+
+    def route(self, rule: str, allowed_methods: List[str] = None, coalesce: bool = False, vary: List[str] = None, coalesce_timeout: float = 5.0, timeout: float = None) -> F:
         """Add route entrypoint."""
 
         def decorator(view_func: F) -> F:
-            self.add_route(rule, view_func, allowed_methods)
+            self.add_route(rule, view_func, allowed_methods, coalesce, vary, coalesce_timeout, timeout)
             return view_func
 
         return decorator
 
     def test_client(self):
+        from requests import Session as RequestsSession
+        from wsgiadapter import WSGIAdapter as RequestsWSGIAdapter
+
         base_url = "http://sixi-web"
         adapter = RequestsWSGIAdapter(self)
 
@@ -161,4 +273,15 @@ class API:
         return decorator
 
     def add_middleware(self, middleware_cls):
-        self.middleware.add(middleware_cls)
+        return self.middleware.add(middleware_cls)
+
+    def background(self, func: Callable, *args, **kwargs) -> bool:
+        """Run ``func`` on the background task pool, outside any request."""
+        return self.background_tasks.submit(func, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        """Drain pending background tasks, including those of mounted APIs."""
+        self.background_tasks.shutdown()
+        for app in self.mounts.values():
+            if isinstance(app, API):
+                app.shutdown()
@@ -0,0 +1,121 @@
+"""Sixi web framework - post-response background tasks."""
+import atexit
+import os
+import queue
+import threading
+import time
+import traceback
+
+BACKGROUND_KEY = "sixi_web.background"
+_STOP = object()
+
+
+class BackgroundTasks:
+    """Bounded worker pool running tasks after their response has been sent.
+
+    When the queue holds ``max_queue`` tasks, ``policy="block"`` makes the submitting
+    request wait for a free slot and ``policy="drop"`` discards the task. Threads are
+    started lazily (and restarted after a fork) on first submit. Pending tasks are
+    drained at interpreter exit, so they also run under servers that never call
+    ``API.shutdown``.
+    """
+
+    def __init__(self, workers=4, max_queue=1000, policy="block"):
+        if policy not in ("block", "drop"):
+            raise ValueError(f"Unknown background task policy: {policy}")
+        self.workers = workers
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0, "total_time": 0.0, "max_time": 0.0}
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._drain_at_exit = False
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if not self._drain_at_exit:
+                atexit.register(self.shutdown)
+                self._drain_at_exit = True
+            self._threads = [threading.Thread(target=self._work, name=f"sixi-background-{i}", daemon=True) for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)``; return False if it was dropped."""
+        if self._pid != os.getpid():
+            self._start()
+        task = (func, args, kwargs)
+        try:
+            if self.policy == "block":
+                self.queue.put(task)
+            else:
+                self.queue.put_nowait(task)
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+            return False
+        with self._lock:
+            self.stats["submitted"] += 1
+        return True
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is _STOP:
+                    return
+                self._run(*task)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, func, args, kwargs):
+        started = time.perf_counter()
+        failed = False
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            failed = True
+            traceback.print_exc()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats["failed" if failed else "completed"] += 1
+            self.stats["total_time"] += elapsed
+            self.stats["max_time"] = max(self.stats["max_time"], elapsed)
+
+    def join(self):
+        """Wait until every queued task has run."""
+        self.queue.join()
+
+    def shutdown(self, wait=True):
+        """Drain pending tasks and stop the worker threads."""
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+        self._pid = None
+
+
+class RunAfterIterator:
+    """Wrap a WSGI app_iter so ``callback`` runs once the server has closed it."""
+
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, "close"):
+                self.app_iter.close()
+        finally:
+            self.callback()
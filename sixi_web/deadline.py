@@ -0,0 +1,72 @@
+"""Sixi web framework - per-request deadlines."""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from webob.exc import HTTPGatewayTimeout
+
+_deadline = ContextVar("sixi_web_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPGatewayTimeout):
+    """Raised when the current request's time budget runs out; answered with 504."""
+
+
+def current_deadline():
+    """Return the ``time.monotonic()`` deadline of the current request, or None."""
+    return _deadline.get()
+
+
+def remaining():
+    """Seconds left before the current deadline, or None without a deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+@contextmanager
+def deadline(timeout):
+    """Run the block with a deadline ``timeout`` seconds from now; nested deadlines only shrink."""
+    if timeout is None:
+        yield
+        return
+    new_deadline = time.monotonic() + timeout
+    outer = _deadline.get()
+    token = _deadline.set(new_deadline if outer is None else min(outer, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class DeadlineStats:
+    """Counts of requests run under a deadline and how much budget they had left."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.exceeded = 0
+        self.min_remaining = None
+        self.total_remaining = 0.0
+
+    def record(self, left, exceeded):
+        with self.lock:
+            self.requests += 1
+            self.exceeded += exceeded
+            self.total_remaining += max(left, 0.0)
+            self.min_remaining = left if self.min_remaining is None else min(self.min_remaining, left)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "exceeded": self.exceeded,
+                "min_remaining": self.min_remaining,
+                "avg_remaining": self.total_remaining / self.requests if self.requests else None,
+            }
@@ -1,5 +1,25 @@
 """Sixi webframework - Middleware class."""
-from webob import Request
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from webob.exc import HTTPServiceUnavailable, HTTPTooManyRequests
+
+from .background import RunAfterIterator
+from .request import Request
+
+ON_CLOSE_KEY = "sixi_web.on_close"
+
+
+def on_close(environ, callback):
+    """Run ``callback`` once the response to ``environ`` has been sent and closed."""
+    environ.setdefault(ON_CLOSE_KEY, []).append(callback)
+
+
+def _run_on_close(environ):
+    for callback in environ.pop(ON_CLOSE_KEY, ()):
+        callback()
 
 
 class Middleware:
@@ -8,11 +28,22 @@ class Middleware:
 
     def __call__(self, environ, start_response):
         req = Request(environ)
-        resp = self.app.despatch_request(req)
-        return resp(environ, start_response)
+        try:
+            resp = self.app.despatch_request(req)
+            app_iter = resp(environ, start_response)
+        except BaseException:
+            _run_on_close(environ)
+            raise
+        if ON_CLOSE_KEY not in environ:
+            return app_iter
+        if isinstance(app_iter, list):
+            _run_on_close(environ)
+            return app_iter
+        return RunAfterIterator(app_iter, lambda: _run_on_close(environ))
 
     def add(self, middleware_cls):
         self.app = middleware_cls(self.app)
+        return self.app
 
     def process_request(self, req):
         pass
@@ -26,3 +57,136 @@ class Middleware:
         self.process_response(req, resp)
 
         return resp
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; return 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class LoadSheddingMiddleware(Middleware):
+    """Bound in-flight requests globally and per route, and rate limit clients.
+
+    Configure by subclassing::
+
+        class Limits(LoadSheddingMiddleware):
+            max_concurrency = 64
+            route_limits = {"/reports/{id}": 4}
+            queue_timeout = 0.1
+            rate = 10
+            burst = 20
+
+        limits = app.add_middleware(Limits)
+
+    A request that cannot get a slot within ``queue_timeout`` seconds is rejected with
+    ``503`` and a ``Retry-After`` header, one over its client's token bucket with ``429``.
+    Buckets are keyed by ``rate_limit_header`` when set and present, otherwise by the
+    peer address (``REMOTE_ADDR``). ``X-Forwarded-For`` is client-controlled and is only
+    used when ``trust_forwarded`` is set, i.e. behind a proxy that overwrites it.
+    Slots are held until the response has been rendered and, for streams, closed.
+    """
+
+    max_concurrency = None
+    route_limits = {}
+    queue_timeout = 0.0
+    retry_after = 1
+    rate = None
+    burst = 1
+    rate_limit_header = None
+    trust_forwarded = False
+    max_buckets = 10000
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency else None
+        self.route_slots = {rule: threading.BoundedSemaphore(limit) for rule, limit in self.route_limits.items()}
+        self.buckets = OrderedDict()
+        self.in_flight = 0
+        self.route_in_flight = {rule: 0 for rule in self.route_limits}
+        self.rejected = {"concurrency": 0, "route": 0, "rate": 0}
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": self.in_flight, "route_in_flight": dict(self.route_in_flight), "rejected": dict(self.rejected)}
+
+    def rate_limit_key(self, req):
+        if self.rate_limit_header:
+            value = req.headers.get(self.rate_limit_header)
+            if value is not None:
+                return ("header", value)
+        return ("addr", req.client_addr if self.trust_forwarded else req.remote_addr)
+
+    def route_rule(self, req):
+        app = self.app
+        while isinstance(app, Middleware):
+            app = app.app
+        view_func_data, _ = app.match(req)
+        return view_func_data and view_func_data["rule"]
+
+    def check_rate(self, req):
+        key = self.rate_limit_key(req)
+        with self.lock:
+            bucket = self.buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+            return bucket.take()
+
+    def reject(self, exc_cls, reason, retry_after):
+        with self.lock:
+            self.rejected[reason] += 1
+        return exc_cls(headers={"Retry-After": str(math.ceil(retry_after))})
+
+    def despatch_request(self, req):
+        if self.rate:
+            wait = self.check_rate(req)
+            if wait:
+                return self.reject(HTTPTooManyRequests, "rate", wait)
+
+        rule = self.route_rule(req) if self.route_slots else None
+        route_slots = self.route_slots.get(rule)
+        deadline = time.monotonic() + self.queue_timeout
+
+        if self.slots is not None and not self.slots.acquire(timeout=self.queue_timeout):
+            return self.reject(HTTPServiceUnavailable, "concurrency", self.retry_after)
+        if route_slots is not None and not route_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            if self.slots is not None:
+                self.slots.release()
+            return self.reject(HTTPServiceUnavailable, "route", self.retry_after)
+
+        rule = rule if route_slots is not None else None
+        self._count(rule, 1)
+        try:
+            resp = super().despatch_request(req)
+        except BaseException:
+            self._release(route_slots, rule)
+            raise
+        on_close(req.environ, lambda: self._release(route_slots, rule))
+        return resp
+
+    def _count(self, rule, delta):
+        with self.lock:
+            self.in_flight += delta
+            if rule is not None:
+                self.route_in_flight[rule] += delta
+
+    def _release(self, route_slots, rule):
+        self._count(rule, -1)
+        if route_slots is not None:
+            route_slots.release()
+        if self.slots is not None:
+            self.slots.release()
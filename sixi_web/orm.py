@@ -1,48 +1,351 @@
+import array
+import asyncio
+import contextvars
+import functools
 import inspect
+import itertools
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .deadline import DeadlineExceeded, check_deadline, current_deadline
+
+PROGRESS_HANDLER_STEPS = 1000
+
+
+def honours_deadline(method):
+    """Fail fast past the request deadline and turn interrupted statements into ``DeadlineExceeded``."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        check_deadline()
+        try:
+            return method(self, *args, **kwargs)
+        except sqlite3.OperationalError as e:
+            deadline = current_deadline()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("Database query interrupted by request deadline") from e
+            raise
+
+    return wrapper
+
+
+class Cache:
+    """Bounded LRU/TTL cache of table rows keyed by (table, id).
+
+    Rows are cached rather than instances, so every lookup still hydrates a
+    fresh ``Table`` object and a cached row never leaks mutations between callers.
+    Every invalidation bumps a per-table generation; a reader passes the generation
+    it saw before querying to ``set``, which drops the row if a write raced it.
+
+    The cache lives in one process and is only invalidated by writes made through
+    that process's ``Database``. Under a multi-process server (e.g. the prefork
+    runner) a write in one worker does not reach the others, so set a ``ttl`` to
+    bound how long they may serve a stale row.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._settings = {}
+        self._rows = {}
+        self._stats = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def configure(self, table, enabled=True, max_size=None):
+        """Enable/disable caching or change the size limit for one table."""
+        name = _table_name(table)
+        with self._lock:
+            self._settings[name] = {"enabled": enabled, "max_size": self.max_size if max_size is None else max_size}
+            rows = self._rows.get(name)
+            if rows is not None:
+                if not enabled:
+                    rows.clear()
+                self._evict(name, rows)
+
+    def enabled(self, table):
+        return self._table_settings(_table_name(table))["enabled"]
+
+    def get(self, table, id):
+        name = _table_name(table)
+        with self._lock:
+            stats = self._stats.setdefault(name, {"hits": 0, "misses": 0})
+            rows = self._rows.get(name)
+            entry = rows.get(id) if rows is not None else None
+            if entry is not None:
+                expires, row = entry
+                if expires is None or expires > time.monotonic():
+                    rows.move_to_end(id)
+                    stats["hits"] += 1
+                    return row
+                del rows[id]
+            stats["misses"] += 1
+        return None
+
+    def generation(self, table):
+        """Return a token for ``set`` that goes stale once ``table`` is invalidated."""
+        return self._generations.get(_table_name(table), 0)
+
+    def set(self, table, id, row, generation=None):
+        name = _table_name(table)
+        if not self._table_settings(name)["enabled"]:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generations.get(name, 0):
+                return
+            rows = self._rows.setdefault(name, OrderedDict())
+            rows[id] = (expires, row)
+            rows.move_to_end(id)
+            self._evict(name, rows)
+
+    def invalidate(self, table, id=None):
+        """Drop one cached row, or every row of ``table`` when ``id`` is None."""
+        name = _table_name(table)
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            rows = self._rows.get(name)
+            if rows is None:
+                return
+            if id is None:
+                rows.clear()
+            else:
+                rows.pop(id, None)
+
+    def clear(self):
+        with self._lock:
+            for name in self._rows:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            self._rows.clear()
+
+    def stats(self):
+        """Return hits, misses, hit rate and size per table."""
+        result = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                total = stats["hits"] + stats["misses"]
+                result[name] = {
+                    "hits": stats["hits"],
+                    "misses": stats["misses"],
+                    "hit_rate": stats["hits"] / total if total else 0.0,
+                    "size": len(self._rows.get(name, ())),
+                }
+        return result
+
+    def _table_settings(self, name):
+        return self._settings.get(name) or {"enabled": True, "max_size": self.max_size}
+
+    def _evict(self, name, rows):
+        max_size = self._table_settings(name)["max_size"]
+        while len(rows) > max_size:
+            rows.popitem(last=False)
 
 
 class Database:
-    def __init__(self, path):
-        self.conn = sqlite3.Connection(path)
+    """SQLite database, optionally with read replicas and per-table shards.
+
+    ``replicas`` are paths to read-only copies of ``path``; ``get``, ``all``, ``page``,
+    ``select`` and ``to_columns`` are routed round-robin across them, everything else
+    goes to the primary. Replicas are opened with ``mode=ro``, and additionally with
+    ``immutable=1`` when ``immutable_replicas`` is set (only safe for files that never
+    change while open). Keeping replicas up to date is left to the caller.
+
+    ``shards`` maps a table to a list of database paths. Rows of a sharded table live
+    in shard ``(id - 1) % len(paths)``: inserts go round-robin and allocate ids in that
+    shard's residue class, lookups by id go to one shard and ``all`` fans out and merges.
+
+    ``check_same_thread`` is passed to ``sqlite3.connect`` for every connection.
+    """
+
+    def __init__(self, path, cache=None, replicas=(), immutable_replicas=False, shards=None, check_same_thread=True):
+        self.check_same_thread = check_same_thread
+        self.conn = self._connect(path)
+        self.cache = cache
+        self.replicas = [self._connect(replica, read_only=True, immutable=immutable_replicas) for replica in replicas]
+        self._replica_cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self.shards = {_table_name(table): [self._connect(shard) for shard in paths] for table, paths in (shards or {}).items()}
+        self._shard_cycles = {name: itertools.cycle(range(len(conns))) for name, conns in self.shards.items()}
+        self._lock = threading.Lock()
+
+    def _connect(self, path, read_only=False, immutable=False):
+        if read_only:
+            uri = f"file:{path}?mode=ro" + ("&immutable=1" if immutable else "")
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=self.check_same_thread)
+        else:
+            conn = sqlite3.Connection(path, check_same_thread=self.check_same_thread)
+        conn.set_progress_handler(self._deadline_passed, PROGRESS_HANDLER_STEPS)
+        return conn
+
+    def _read_conns(self, table):
+        """Connections to read ``table`` from: every shard, or one replica, or the primary."""
+        shards = self.shards.get(_table_name(table))
+        if shards:
+            return shards
+        if self._replica_cycle is not None:
+            with self._lock:
+                return [next(self._replica_cycle)]
+        return [self.conn]
+
+    def _conn_for(self, table, id, read=False):
+        shards = self.shards.get(_table_name(table))
+        if shards:
+            return shards[(int(id) - 1) % len(shards)]
+        return self._read_conns(table)[0] if read else self.conn
+
+    def close(self):
+        """Close the primary, replica and shard connections."""
+        for conn in [self.conn, *self.replicas, *(conn for conns in self.shards.values() for conn in conns)]:
+            conn.close()
+
+    @staticmethod
+    def _deadline_passed():
+        deadline = current_deadline()
+        return deadline is not None and time.monotonic() >= deadline
+
+    def enable_cache(self, max_size=1024, ttl=None):
+        """Attach a read-through row cache used by ``get`` and ``all``.
+
+        The cache is per process; with several worker processes pass a ``ttl`` (seconds),
+        as writes made by other processes never invalidate it.
+        """
+        self.cache = Cache(max_size=max_size, ttl=ttl)
+        return self.cache
 
     @property
+    @honours_deadline
     def tables(self):
         SELECT_TABLES_SQL = "SELECT NAME FROM sqlite_master WHERE type='table';"
         return [x[0] for x in self.conn.execute(SELECT_TABLES_SQL).fetchall()]
 
+    @honours_deadline
+    def query(self, sql, params=()):
+        """Run a raw SQL statement and return all resulting rows."""
+        return self.conn.execute(sql, params).fetchall()
+
+    @honours_deadline
     def create(self, table):
-        self.conn.execute(table._get_create_sql())
+        for conn in self.shards.get(_table_name(table)) or [self.conn]:
+            conn.execute(table._get_create_sql())
 
+    @honours_deadline
     def save(self, instance):
-        sql, values = instance._get_insert_sql()
-        cursor = self.conn.execute(sql, values)
+        shards = self.shards.get(_table_name(instance.__class__))
+        if shards:
+            with self._lock:
+                index = next(self._shard_cycles[_table_name(instance.__class__)])
+            conn = shards[index]
+            sql, values = instance._get_sharded_insert_sql(index, len(shards))
+        else:
+            conn = self.conn
+            sql, values = instance._get_insert_sql()
+        cursor = conn.execute(sql, values)
         instance._data["id"] = cursor.lastrowid
-        self.conn.commit()
+        conn.commit()
+        self._invalidate(instance.__class__, instance.id)
 
+    @honours_deadline
     def all(self, table):
         sql, fields = table._get_select_all_sql()
 
         result = []
-        for row in self.conn.execute(sql).fetchall():
-            instance = table()
-            for field, value in zip(fields, row):
-                if field.endswith("_id"):
-                    field = field[:-3]
-                    fk = getattr(table, field)
-                    value = self.get(fk.table, id=value)
-                setattr(instance, field, value)
-            result.append(instance)
+        generation = self._cache_generation(table)
+        for row in self._fetch_all(table, sql):
+            if generation is not None:
+                self.cache.set(table, row[0], row, generation)
+            result.append(self._build(table, fields, row))
+
+        return result
+
+    @honours_deadline
+    def page(self, table, after_id=0, limit=100):
+        """Return up to ``limit`` instances with id greater than ``after_id``, ordered by id."""
+        sql, fields, params = table._get_select_page_sql(after_id, limit)
+
+        result = []
+        generation = self._cache_generation(table)
+        for row in self._fetch_all(table, sql, params)[:limit]:
+            if generation is not None:
+                self.cache.set(table, row[0], row, generation)
+            result.append(self._build(table, fields, row))
 
         return result
 
+    def select(self, table, columns=None, where=None):
+        """Return the selected field names and an open cursor over the matching raw rows.
+
+        ``where`` is an optional mapping of column to value, combined with AND.
+        """
+        sql, fields, params = table._get_select_columns_sql(columns, where)
+        cursors = [conn.execute(sql, params) for conn in self._read_conns(table)]
+        return fields, cursors[0] if len(cursors) == 1 else ChainedCursor(cursors)
+
+    @honours_deadline
+    def to_columns(self, table, columns=None, where=None, batch_size=1000):
+        """Read ``columns`` of ``table`` into per-column arrays without building row objects.
+
+        Columns are NumPy arrays when NumPy is installed, otherwise ``array.array``
+        for numeric columns and lists for text/blob columns. Numeric columns holding
+        NULLs fall back to lists, foreign keys are returned as their ids.
+        """
+        fields, cursor = self.select(table, columns, where)
+        types = table._get_column_types()
+        arrays = [_new_column(types[field]) for field in fields]
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                if isinstance(arrays[i], array.array) and None in values:
+                    arrays[i] = list(arrays[i])
+                arrays[i].extend(values)
+
+        return {field: _to_ndarray(values, types[field]) for field, values in zip(fields, arrays)}
+
+    @honours_deadline
     def get(self, table, id):
+        id = int(id)
         sql, fields, params = table._get_select_where_sql(id=id)
 
-        row = self.conn.execute(sql, params).fetchone()
+        row = self.cache.get(table, id) if self._cache_enabled(table) else None
         if row is None:
-            raise Exception(f"{table.__name__} instance with id {id} does not exist")
+            generation = self._cache_generation(table)
+            row = self._conn_for(table, id, read=True).execute(sql, params).fetchone()
+            if row is None:
+                raise Exception(f"{table.__name__} instance with id {id} does not exist")
+            if generation is not None:
+                self.cache.set(table, id, row, generation)
+
+        return self._build(table, fields, row)
 
+    @honours_deadline
+    def update(self, instance):
+        sql, values = instance._get_update_sql()
+        conn = self._conn_for(instance.__class__, instance.id)
+        conn.execute(sql, values)
+        conn.commit()
+        self._invalidate(instance.__class__, instance.id)
+
+    @honours_deadline
+    def delete(self, table, id):
+        id = int(id)
+        sql, params = table._get_delete_sql(id)
+        conn = self._conn_for(table, id)
+        conn.execute(sql, params)
+        conn.commit()
+        self._invalidate(table, id)
+
+    def _fetch_all(self, table, sql, params=()):
+        conns = self._read_conns(table)
+        if len(conns) == 1:
+            return conns[0].execute(sql, params).fetchall()
+        rows = [row for conn in conns for row in conn.execute(sql, params).fetchall()]
+        return sorted(rows, key=lambda row: row[0])
+
+    def _build(self, table, fields, row):
         instance = table()
         for field, value in zip(fields, row):
             if field.endswith("_id"):
@@ -50,18 +353,133 @@ class Database:
                 fk = getattr(table, field)
                 value = self.get(fk.table, id=value)
             setattr(instance, field, value)
-
         return instance
 
-    def update(self, instance):
-        sql, values = instance._get_update_sql()
-        self.conn.execute(sql, values)
-        self.conn.commit()
+    def _cache_enabled(self, table):
+        return self.cache is not None and self.cache.enabled(table)
 
-    def delete(self, table, id):
-        sql, params = table._get_delete_sql(id)
-        self.conn.execute(sql, params)
-        self.conn.commit()
+    def _cache_generation(self, table):
+        return self.cache.generation(table) if self._cache_enabled(table) else None
+
+    def _invalidate(self, table, id):
+        if self.cache is not None:
+            self.cache.invalidate(table, id)
+
+
+class ChainedCursor:
+    """Read-only cursor reading several cursors one after another."""
+
+    def __init__(self, cursors):
+        self.cursors = list(cursors)
+
+    def fetchmany(self, size=1):
+        rows = []
+        while self.cursors and len(rows) < size:
+            batch = self.cursors[0].fetchmany(size - len(rows))
+            if not batch:
+                self.cursors.pop(0)
+            rows.extend(batch)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        rows = []
+        for cursor in self.cursors:
+            rows.extend(cursor.fetchall())
+        self.cursors = []
+        return rows
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.cursors)
+
+
+class AsyncDatabase:
+    """Awaitable facade over ``Database``.
+
+    Statements run on a dedicated bounded thread pool; each worker thread owns its
+    own ``Database`` connection. At most ``max_pending`` calls may be queued or
+    running at once, further callers wait for a free slot. An instance is bound to
+    the event loop it is first awaited on.
+    """
+
+    def __init__(self, path, workers=4, max_pending=64, cache=None, **options):
+        self.path = path
+        self.cache = cache
+        self.options = options
+        self.max_pending = max_pending
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sixi-db")
+        self._slots = None
+        self._dbs = []
+        self._dbs_lock = threading.Lock()
+
+    @property
+    def db(self):
+        """The ``Database`` owned by the current worker thread."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Closed from ``close`` once the worker threads have exited.
+            db = self._local.db = Database(self.path, cache=self.cache, check_same_thread=False, **self.options)
+            with self._dbs_lock:
+                self._dbs.append(db)
+        return db
+
+    async def run(self, method, *args, **kwargs):
+        """Run ``Database.<method>`` on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, context.run, self._call, method, args, kwargs)
+
+    def _call(self, method, args, kwargs):
+        return getattr(self.db, method)(*args, **kwargs)
+
+    async def acreate(self, table):
+        return await self.run("create", table)
+
+    async def aget(self, table, id):
+        return await self.run("get", table, id)
+
+    async def aall(self, table):
+        return await self.run("all", table)
+
+    async def asave(self, instance):
+        return await self.run("save", instance)
+
+    async def aupdate(self, instance):
+        return await self.run("update", instance)
+
+    async def adelete(self, table, id):
+        return await self.run("delete", table, id)
+
+    async def aiter(self, table, batch_size=100):
+        """Asynchronously iterate over every row of ``table`` in batches."""
+        after_id = 0
+        while True:
+            batch = await self.run("page", table, after_id, batch_size)
+            for instance in batch:
+                yield instance
+            if len(batch) < batch_size:
+                return
+            after_id = batch[-1].id
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._dbs_lock:
+            dbs, self._dbs = self._dbs, []
+        for db in dbs:
+            db.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
 
 
 class Table:
@@ -152,6 +570,73 @@ class Table:
 
         return sql, fields, params
 
+    @classmethod
+    def _get_select_page_sql(cls, after_id, limit):
+        SELECT_PAGE_SQL = "SELECT {fields} FROM {name} WHERE id > ? ORDER BY id LIMIT ?;"
+        _, fields = cls._get_select_all_sql()
+        sql = SELECT_PAGE_SQL.format(name=cls.__name__.lower(), fields=", ".join(fields))
+        return sql, fields, [after_id, limit]
+
+    @classmethod
+    def _get_column_types(cls):
+        types = {"id": int}
+        for name, field in inspect.getmembers(cls):
+            if isinstance(field, Column):
+                types[name] = field.type
+            elif isinstance(field, ForeignKey):
+                types[name + "_id"] = int
+        return types
+
+    @classmethod
+    def _get_select_columns_sql(cls, columns=None, where=None):
+        SELECT_COLUMNS_SQL = "SELECT {fields} FROM {name}{where};"
+        types = cls._get_column_types()
+
+        def _field(name):
+            if name not in types and name + "_id" in types:
+                name += "_id"
+            if name not in types:
+                raise AttributeError(f"{cls.__name__} has no column {name}")
+            return name
+
+        if columns is None:
+            _, fields = cls._get_select_all_sql()
+        else:
+            fields = [_field(name) for name in columns]
+
+        conditions = []
+        params = []
+        for name, value in (where or {}).items():
+            conditions.append(f"{_field(name)} = ?")
+            params.append(value.id if isinstance(value, Table) else value)
+        where_sql = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        sql = SELECT_COLUMNS_SQL.format(name=cls.__name__.lower(), fields=", ".join(fields), where=where_sql)
+        return sql, fields, params
+
+    def _get_sharded_insert_sql(self, shard_index, shard_count):
+        """Insert with the shard's next id, keeping ``(id - 1) % shard_count == shard_index``.
+
+        The next id is taken from the table's AUTOINCREMENT high-water mark in
+        ``sqlite_sequence``, so ids of deleted rows are never handed out again.
+        """
+        SHARDED_INSERT_SQL = "INSERT INTO {name} (id, {fields}) VALUES ((SELECT COALESCE(MAX(seq), ?) + ? FROM sqlite_sequence WHERE name = ?), {placeholders});"
+        cls = self.__class__
+        fields = []
+        values = [shard_index + 1 - shard_count, shard_count, cls.__name__.lower()]
+
+        for name, field in inspect.getmembers(cls):
+            if isinstance(field, Column):
+                fields.append(name)
+                values.append(getattr(self, name))
+            elif isinstance(field, ForeignKey):
+                fields.append(name + "_id")
+                values.append(getattr(self, name).id)
+
+        placeholders = ", ".join("?" * len(fields))
+        sql = SHARDED_INSERT_SQL.format(name=cls.__name__.lower(), fields=", ".join(fields), placeholders=placeholders)
+        return sql, values
+
     def _get_update_sql(self):
         UPDATE_SQL = "UPDATE {name} SET {fields} WHERE id = ?"
         cls = self.__class__
@@ -200,3 +685,27 @@ class Column:
 class ForeignKey:
     def __init__(self, table):
         self.table = table
+
+
+def _table_name(table):
+    return table if isinstance(table, str) else table.__name__.lower()
+
+
+ARRAY_TYPECODES = {int: "q", float: "d", bool: "q"}
+NUMPY_DTYPES = {int: "int64", float: "float64", bool: "bool"}
+
+
+def _new_column(column_type):
+    typecode = ARRAY_TYPECODES.get(column_type)
+    return array.array(typecode) if typecode else []
+
+
+def _to_ndarray(values, column_type):
+    try:
+        import numpy
+    except ImportError:
+        return values
+
+    if isinstance(values, array.array):
+        return numpy.frombuffer(values, dtype=values.typecode).astype(NUMPY_DTYPES[column_type], copy=False)
+    return numpy.array(values, dtype=object)
@@ -0,0 +1,256 @@
+"""Sixi web framework - Request class."""
+import hashlib
+import json
+
+from webob import Request as WebobRequest
+from webob.exc import HTTPBadRequest, HTTPRequestEntityTooLarge
+from webob.multidict import MultiDict
+
+MAX_BODY_SIZE_KEY = "sixi_web.max_body_size"
+SPOOL_THRESHOLD_KEY = "sixi_web.spool_threshold"
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+
+class Request(WebobRequest):
+    """WebOb request with bounded, streaming body handling.
+
+    ``json``, ``form`` and ``files`` are parsed once and cached in the WSGI environ,
+    so every ``Request`` built over the same environ shares the result. A multipart
+    body is streamed by ``form``/``files`` without being kept, so ``body`` and ``POST``
+    raise ``RuntimeError`` once it has been parsed.
+    """
+
+    @property
+    def max_body_size(self):
+        return self.environ.get(MAX_BODY_SIZE_KEY)
+
+    @property
+    def spool_threshold(self):
+        return self.environ.get(SPOOL_THRESHOLD_KEY, DEFAULT_SPOOL_THRESHOLD)
+
+    def check_body_size(self):
+        """Reject a declared body over ``max_body_size`` and bound undeclared ones."""
+        if self.max_body_size is None or self.environ.get("sixi_web.body_checked"):
+            return
+        self.environ["sixi_web.body_checked"] = True
+        if self.content_length is not None:
+            if self.content_length > self.max_body_size:
+                raise HTTPRequestEntityTooLarge(f"Request body exceeds {self.max_body_size} bytes")
+        else:
+            self.environ["wsgi.input"] = BoundedInput(self.environ["wsgi.input"], self.max_body_size)
+
+    @property
+    def body(self):
+        self._check_body_available()
+        return WebobRequest.body.fget(self)
+
+    @body.setter
+    def body(self, value):
+        WebobRequest.body.fset(self, value)
+
+    @body.deleter
+    def body(self):
+        WebobRequest.body.fdel(self)
+
+    @property
+    def POST(self):
+        self._check_body_available()
+        return WebobRequest.POST.fget(self)
+
+    def _check_body_available(self):
+        if "sixi_web.multipart" in self.environ:
+            raise RuntimeError("The multipart body was consumed by req.form/req.files and cannot be read again")
+
+    @property
+    def json(self):
+        """The decoded JSON body; a malformed body is answered with 400."""
+        if "sixi_web.json" not in self.environ:
+            try:
+                self.environ["sixi_web.json"] = json.loads(self.body.decode(self.charset or "utf-8"))
+            except ValueError as e:
+                raise HTTPBadRequest(f"Malformed JSON body: {e}")
+        return self.environ["sixi_web.json"]
+
+    @json.setter
+    def json(self, value):
+        self.environ.pop("sixi_web.json", None)
+        WebobRequest.json.fset(self, value)
+
+    @json.deleter
+    def json(self):
+        self.environ.pop("sixi_web.json", None)
+        WebobRequest.json.fdel(self)
+
+    @property
+    def form(self):
+        """Non-file multipart fields as a ``MultiDict``, or ``POST`` for other content types."""
+        if not self.content_type.startswith("multipart/"):
+            return self.POST
+        return self._multipart()[0]
+
+    @property
+    def files(self):
+        """Multipart file parts as a ``MultiDict`` of ``UploadedFile`` objects."""
+        if not self.content_type.startswith("multipart/"):
+            return MultiDict()
+        return self._multipart()[1]
+
+    def _multipart(self):
+        if "sixi_web.multipart" not in self.environ:
+            _, params = _parse_header_value(self._content_type_raw)
+            boundary = params.get("boundary")
+            if not boundary:
+                raise HTTPBadRequest("Missing multipart boundary")
+            self.check_body_size()
+            parser = MultipartParser(self.body_file_raw, boundary.encode("latin-1"), self.content_length, self.spool_threshold)
+            self.environ["sixi_web.multipart"] = parser.parse()
+        return self.environ["sixi_web.multipart"]
+
+
+class BoundedInput:
+    """File-like wrapper raising ``HTTPRequestEntityTooLarge`` past ``limit`` bytes."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.read_bytes = 0
+
+    def _count(self, data):
+        self.read_bytes += len(data)
+        if self.read_bytes > self.limit:
+            raise HTTPRequestEntityTooLarge(f"Request body exceeds {self.limit} bytes")
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.limit - self.read_bytes + 1
+        return self._count(self.stream.read(size))
+
+    def readline(self, size=-1):
+        return self._count(self.stream.readline(size))
+
+
+class UploadedFile:
+    """A multipart part spooled to memory or disk, hashed while it streams in.
+
+    Writing past ``max_size`` bytes raises ``HTTPRequestEntityTooLarge``.
+    """
+
+    def __init__(self, name, filename, content_type, spool_threshold, max_size=None):
+        from tempfile import SpooledTemporaryFile
+
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file = SpooledTemporaryFile(max_size=spool_threshold)
+        self.size = 0
+        self.max_size = max_size
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            raise HTTPRequestEntityTooLarge(f"Multipart field {self.name!r} exceeds {self.max_size} bytes")
+        self.file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def close(self):
+        self.file.close()
+
+
+class MultipartParser:
+    """Incremental ``multipart/form-data`` parser holding at most one chunk in memory.
+
+    The preamble and part headers are limited to ``MAX_PART_HEADER_SIZE`` bytes and non-file fields,
+    which are decoded into memory, to ``spool_threshold`` bytes.
+    """
+
+    def __init__(self, stream, boundary, length, spool_threshold, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.delimiter = b"\r\n--" + boundary
+        self.remaining = length
+        self.spool_threshold = spool_threshold
+        self.chunk_size = chunk_size
+        self.buffer = b"\r\n"
+
+    def _fill(self):
+        size = self.chunk_size if self.remaining is None else min(self.chunk_size, self.remaining)
+        data = self.stream.read(size) if size else b""
+        if not data:
+            raise HTTPBadRequest("Truncated multipart body")
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        self.buffer += data
+
+    def _read_until(self, marker, part=None, limit=None):
+        """Consume the buffer up to ``marker``, streaming skipped bytes into ``part``."""
+        while True:
+            index = self.buffer.find(marker)
+            if index >= 0:
+                if part is not None:
+                    part.write(self.buffer[:index])
+                data, self.buffer = self.buffer[:index], self.buffer[index + len(marker) :]
+                return data
+            keep = len(marker) - 1
+            if part is not None and len(self.buffer) > keep:
+                part.write(self.buffer[:-keep])
+                self.buffer = self.buffer[-keep:]
+            if limit is not None and len(self.buffer) > limit + keep:
+                raise HTTPBadRequest(f"No multipart delimiter within {limit} bytes")
+            self._fill()
+
+    def _read_exact(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def parse(self):
+        form, files = MultiDict(), MultiDict()
+        self._read_until(self.delimiter, limit=MAX_PART_HEADER_SIZE)
+        while self._read_exact(2) != b"--":
+            headers = _parse_headers(self._read_until(b"\r\n\r\n", limit=MAX_PART_HEADER_SIZE))
+            disposition, params = _parse_header_value(headers.get("content-disposition", ""))
+            name = params.get("name")
+            if disposition != "form-data" or name is None:
+                raise HTTPBadRequest("Invalid multipart part")
+
+            filename = params.get("filename")
+            max_size = self.spool_threshold if filename is None else None
+            part = UploadedFile(name, filename, headers.get("content-type"), self.spool_threshold, max_size)
+            self._read_until(self.delimiter, part)
+            part.file.seek(0)
+            if part.filename is None:
+                form.add(name, part.read().decode("utf-8"))
+                part.close()
+            else:
+                files.add(name, part)
+        return form, files
+
+
+def _parse_headers(data):
+    headers = {}
+    for line in data.decode("latin-1").split("\r\n"):
+        key, _, value = line.partition(":")
+        if key:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def _parse_header_value(value):
+    """Split ``form-data; name="a"; filename="b"`` into ("form-data", {...})."""
+    main, *items = value.split(";")
+    params = {}
+    for item in items:
+        key, _, val = item.strip().partition("=")
+        params[key.lower()] = val.strip('"')
+    return main.strip().lower(), params
@@ -1,7 +1,16 @@
+import csv
+import hashlib
+import io
 import json
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
 
 from webob import Response as WebobResponse
 
+from .background import BACKGROUND_KEY, RunAfterIterator
+
+AUTO_ETAG_KEY = "sixi_web.auto_etag"
+
 
 class Response:
     def __init__(self):
@@ -10,7 +19,12 @@ class Response:
         self.html = None
         self.content_type = None
         self.body = b""
+        self.stream = None
         self.status_code = 200
+        self.tasks = []
+        self.etag = None
+        self.last_modified = None
+        self.renderer = None
 
     def set_body_and_content_type(self):
         if self.json is not None:
@@ -25,7 +39,132 @@ class Response:
             self.body = self.text
             self.content_type = "text/plain"
 
-    def __call__(self, environ, start_response):
+    def defer(self, func, *args, **kwargs):
+        """Produce the body later with ``func(resp, *args, **kwargs)``.
+
+        The renderer is skipped entirely for HEAD requests and for conditional
+        requests answered with ``304 Not Modified`` from a handler-supplied ``etag``
+        or ``last_modified``.
+        """
+        self.renderer = (func, args, kwargs)
+
+    def render(self):
+        if self.renderer is not None:
+            func, args, kwargs = self.renderer
+            self.renderer = None
+            func(self, *args, **kwargs)
+
+    def validators(self):
+        """Return the ETag and Last-Modified response headers."""
+        headers = {}
+        if self.etag is not None:
+            headers["ETag"] = self.etag if self.etag.startswith(('W/"', '"')) else f'"{self.etag}"'
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(_as_utc(self.last_modified), usegmt=True)
+        return headers
+
+    def not_modified(self, environ):
+        """Whether the request's validators match, per RFC 9110 section 13.1."""
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            if self.etag is None:
+                return False
+            etag = _opaque_tag(self.validators()["ETag"])
+            return any(tag == "*" or _opaque_tag(tag) == etag for tag in if_none_match.split(","))
+
+        if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+        if if_modified_since is not None and self.last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return _as_utc(self.last_modified).replace(microsecond=0) <= _as_utc(since)
+        return False
+
+    def background(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` once the response body has been sent."""
+        self.tasks.append((func, args, kwargs))
+
+    def run_tasks(self, environ):
+        pool = environ.get(BACKGROUND_KEY)
+        for func, args, kwargs in self.tasks:
+            if pool is None:
+                func(*args, **kwargs)
+            else:
+                pool.submit(func, *args, **kwargs)
+
+    def stream_ndjson(self, fields, cursor, batch_size=1000):
+        """Stream rows from ``cursor`` as newline-delimited JSON, one chunk per batch."""
+        self.content_type = "application/x-ndjson"
+        self.stream = _iter_batches(cursor, batch_size, lambda rows: "".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows))
+
+    def stream_csv(self, fields, cursor, batch_size=1000):
+        """Stream rows from ``cursor`` as CSV with a header line, one chunk per batch."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+
+        def encode(rows):
+            writer.writerows(rows)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        self.content_type = "text/csv"
+        self.stream = _iter_batches(cursor, batch_size, encode, header=encode([]))
+
+    def build(self, environ):
+        """Build the WebOb response, answering conditional GET/HEAD requests with 304."""
+        response = self._build(environ)
+        response.headers.update(self.validators())
+        return response
+
+    def _build(self, environ):
+        method = environ.get("REQUEST_METHOD")
+        conditional = self.stream is None and self.status_code == 200 and method in ("GET", "HEAD")
+
+        if conditional and self.not_modified(environ):
+            return WebobResponse(status=304, content_type=None)
+        if conditional and method == "HEAD" and self.renderer is not None:
+            return WebobResponse(app_iter=[], content_type=self.content_type, status=self.status_code)
+        if self.stream is not None:
+            return WebobResponse(app_iter=self.stream, content_type=self.content_type, status=self.status_code)
+
+        self.render()
         self.set_body_and_content_type()
-        response = WebobResponse(body=self.body, content_type=self.content_type, status=self.status_code)
-        return response(environ, start_response)
+        if conditional and self.etag is None and environ.get(AUTO_ETAG_KEY):
+            body = self.body.encode("utf-8") if isinstance(self.body, str) else self.body
+            self.etag = 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+            if self.not_modified(environ):
+                return WebobResponse(status=304, content_type=None)
+        return WebobResponse(body=self.body, content_type=self.content_type, status=self.status_code)
+
+    def __call__(self, environ, start_response):
+        response = self.build(environ)
+        app_iter = response(environ, start_response)
+        if self.tasks:
+            return RunAfterIterator(app_iter, lambda: self.run_tasks(environ))
+        return app_iter
+
+
+def _as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _opaque_tag(tag):
+    """Strip the weak indicator, for weak comparison of entity tags."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _iter_batches(cursor, batch_size, encode, header=""):
+    if header:
+        yield header.encode("utf-8")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield encode(rows).encode("utf-8")
@@ -0,0 +1,216 @@
+"""Sixi web framework - prefork server runner."""
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+
+def load_app(target: str):
+    """Import ``module:attribute`` and return the WSGI application."""
+    module_name, _, attr = target.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, attr or "app")
+
+
+def memory_usage(pid="self"):
+    """Return shared and private memory of a process in KiB, from ``/proc/<pid>/smaps_rollup``."""
+    usage = {"shared": 0, "private": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.startswith("Shared_"):
+                    usage["shared"] += int(value.split()[0])
+                elif key.startswith("Private_"):
+                    usage["private"] += int(value.split()[0])
+    except OSError:
+        return None
+    return usage
+
+
+def log(message):
+    sys.stderr.write(f"[sixi-web {os.getpid()}] {message}\n")
+    sys.stderr.flush()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class CountingServer(WSGIServer):
+    last_request_done = False
+    last_request_time = 0.0
+
+    def process_request(self, request, client_address):
+        started = time.perf_counter()
+        super().process_request(request, client_address)
+        self.last_request_time = time.perf_counter() - started
+
+    def shutdown_request(self, request):
+        super().shutdown_request(request)
+        self.last_request_done = True
+
+
+class Worker:
+    """Serve requests from an inherited listening socket until stopped or recycled."""
+
+    def __init__(self, app, sock, max_requests=0, forked_at=None):
+        self.app = app
+        self.sock = sock
+        self.max_requests = max_requests
+        self.forked_at = forked_at or time.perf_counter()
+        self.handled = 0
+        self.alive = True
+
+    def stop(self, signum=None, frame=None):
+        self.alive = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+        server = CountingServer(self.sock.getsockname(), QuietHandler, bind_and_activate=False)
+        server.socket = self.sock
+        server.server_name, server.server_port = socket.getfqdn(self.sock.getsockname()[0]), self.sock.getsockname()[1]
+        server.setup_environ()
+        server.set_app(self.app)
+        server.timeout = 0.5
+
+        while self.alive:
+            server.handle_request()
+            if not server.last_request_done:
+                continue
+            server.last_request_done = False
+            self.handled += 1
+            if self.handled == 1:
+                usage = memory_usage()
+                shared = f", shared {usage['shared']} KiB / private {usage['private']} KiB" if usage else ""
+                since_fork = time.perf_counter() - self.forked_at
+                log(f"first response took {server.last_request_time * 1000:.1f}ms ({since_fork:.1f}s after fork){shared}")
+            if self.max_requests and self.handled >= self.max_requests:
+                log(f"recycling after {self.handled} requests")
+                break
+
+        shutdown = getattr(self.app, "shutdown", None)
+        if shutdown is not None:
+            shutdown()
+
+
+class Arbiter:
+    """Preload and warm the app once, then fork workers that share one listening socket.
+
+    ``SIGHUP`` re-imports and re-warms the app and gracefully replaces every worker;
+    ``SIGTERM``/``SIGINT`` stop the workers and exit. Workers that exit, e.g. after
+    ``max_requests``, are replaced.
+    """
+
+    def __init__(self, target, host="127.0.0.1", port=8000, workers=2, max_requests=0):
+        self.target = target
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.workers = set()
+        self.app = None
+        self.sock = None
+        self.running = True
+        self.reloading = False
+
+    def load(self):
+        started = time.perf_counter()
+        if self.app is not None:
+            module_name = self.target.partition(":")[0]
+            importlib.reload(sys.modules[module_name])
+        self.app = load_app(self.target)
+        warmup = getattr(self.app, "warmup", None)
+        if warmup is not None:
+            warmup()
+        log(f"loaded {self.target} in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    def spawn(self):
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        code = 0
+        try:
+            Worker(self.app, self.sock, self.max_requests, forked_at).run()
+        except Exception as e:
+            log(f"worker crashed: {e!r}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop_workers(self, pids=None):
+        for pid in list(self.workers if pids is None else pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.workers.discard(pid)
+
+    def reload(self, signum=None, frame=None):
+        self.reloading = True
+
+    def shutdown(self, signum=None, frame=None):
+        self.running = False
+
+    def report_memory(self):
+        usages = [memory_usage(pid) for pid in self.workers]
+        usages = [usage for usage in usages if usage]
+        if usages:
+            shared = sum(usage["shared"] for usage in usages)
+            log(f"{len(usages)} workers share {shared} KiB of copy-on-write pages")
+
+    def reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self.workers.discard(pid)
+
+    def run(self):
+        self.load()
+        self.sock = socket.create_server((self.host, self.port), reuse_port=False, backlog=128)
+        self.sock.set_inheritable(True)
+        log(f"listening on http://{self.host}:{self.sock.getsockname()[1]} with {self.num_workers} workers")
+
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+
+        reported = False
+        try:
+            while self.running:
+                if self.reloading:
+                    self.reloading = False
+                    old_workers = set(self.workers)
+                    self.load()
+                    for _ in range(self.num_workers):
+                        self.spawn()
+                    self.stop_workers(old_workers)
+                self.reap()
+                while len(self.workers) < self.num_workers and self.running:
+                    self.spawn()
+                if not reported:
+                    time.sleep(0.5)
+                    self.report_memory()
+                    reported = True
+                time.sleep(0.1)
+        finally:
+            self.stop_workers()
+            while self.workers:
+                try:
+                    pid, _ = os.wait()
+                except ChildProcessError:
+                    break
+                self.workers.discard(pid)
+            self.sock.close()
@@ -0,0 +1,69 @@
+"""Sixi web framework - single-flight request coalescing."""
+import threading
+
+from .response import Response
+
+COALESCE_METHODS = ("GET", "HEAD")
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Share one execution among concurrent identical requests.
+
+    The first request for a key (the leader) runs the view, concurrent requests with
+    the same key wait up to ``timeout`` seconds for its serialised response and get a
+    copy of it. Followers that time out, or whose leader failed or produced a response
+    that cannot be shared (a stream, background tasks, a WebOb exception), run the
+    view themselves.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(req, vary=()):
+        return (req.method, req.path_qs) + tuple(req.headers.get(header) for header in vary)
+
+    def do(self, key, func, timeout):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            if call.done.wait(timeout) and call.result is not None:
+                return copy_response(call.result)
+            return func()
+
+        try:
+            resp = func()
+            if shareable(resp):
+                resp.render()
+                resp.set_body_and_content_type()
+                call.result = resp
+            return resp
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+def shareable(resp):
+    return isinstance(resp, Response) and resp.stream is None and not resp.tasks
+
+
+def copy_response(resp):
+    copy = Response()
+    copy.body = resp.body
+    copy.content_type = resp.content_type
+    copy.status_code = resp.status_code
+    copy.etag = resp.etag
+    copy.last_modified = resp.last_modified
+    return copy
@@ -1,9 +1,13 @@
+import asyncio
 import os
+import shutil
 import sqlite3
+import time
 
 import pytest
 
-from sixi_web import Column, Database, ForeignKey, Table
+from sixi_web import AsyncDatabase, Column, Database, ForeignKey, Table
+from sixi_web.deadline import DeadlineExceeded, deadline
 
 
 @pytest.fixture
@@ -176,3 +180,246 @@ def test_delete_author(db, Author):
 
     with pytest.raises(Exception):
         db.get(Author, 1)
+
+
+def test_cached_get_skips_query(db, Author):
+    db.create(Author)
+    cache = db.enable_cache()
+    lisi = Author(name="lisi", age=23)
+    db.save(lisi)
+
+    assert db.get(Author, 1).name == "lisi"
+    db.conn.execute("UPDATE author SET name = 'changed behind the cache' WHERE id = 1")
+    assert db.get(Author, 1).name == "lisi"
+
+    assert cache.stats()["author"]["hits"] == 1
+    assert cache.stats()["author"]["misses"] == 1
+
+
+def test_cache_invalidated_on_write(db, Author):
+    db.create(Author)
+    db.enable_cache()
+    lisi = Author(name="lisi", age=23)
+    db.save(lisi)
+    db.get(Author, 1)
+
+    lisi.name = "lisi2"
+    db.update(lisi)
+    assert db.get(Author, 1).name == "lisi2"
+
+    db.delete(Author, id=1)
+    with pytest.raises(Exception):
+        db.get(Author, 1)
+
+
+def test_cache_normalises_string_ids(db, Author):
+    db.create(Author)
+    db.enable_cache()
+    lisi = Author(name="lisi", age=23)
+    db.save(lisi)
+    db.get(Author, "1")
+
+    lisi.name = "lisi2"
+    db.update(lisi)
+    assert db.get(Author, "1").name == "lisi2"
+
+    db.delete(Author, id="1")
+    with pytest.raises(Exception):
+        db.get(Author, 1)
+
+
+def test_cache_drops_row_read_before_invalidation(db, Author):
+    db.create(Author)
+    cache = db.enable_cache()
+    db.save(Author(name="lisi", age=23))
+    stale_row = db.conn.execute("SELECT id, age, name FROM author WHERE id = 1").fetchone()
+
+    generation = cache.generation(Author)
+    db.conn.execute("UPDATE author SET name = 'lisi2' WHERE id = 1")
+    cache.invalidate(Author, 1)
+    cache.set(Author, 1, stale_row, generation)
+
+    assert db.get(Author, 1).name == "lisi2"
+
+
+def test_cache_populated_by_all(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    cache = db.enable_cache()
+    lisi = Author(name="lisi", age=43)
+    db.save(lisi)
+    db.save(Book(title="book1", published=False, author=lisi))
+    db.save(Book(title="book2", published=True, author=lisi))
+
+    db.all(Book)
+    db.get(Book, 2)
+
+    assert cache.stats()["book"]["hits"] == 1
+    assert cache.stats()["author"]["hits"] == 2
+
+
+def test_cache_size_limit_and_per_table_disable(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    cache = db.enable_cache(max_size=2)
+    cache.configure(Book, enabled=False)
+    for age in range(3):
+        db.save(Author(name="author", age=age))
+    lisi = db.get(Author, 1)
+    db.save(Book(title="book1", published=False, author=lisi))
+
+    db.all(Author)
+    db.get(Book, 1)
+
+    assert cache.stats()["author"]["size"] == 2
+    assert "book" not in cache.stats()
+
+
+def test_async_database(db, Author):
+    db.create(Author)
+
+    async def main():
+        async with AsyncDatabase("./test.db", workers=2, max_pending=2) as adb:
+            await asyncio.gather(*[adb.asave(Author(name=f"author{i}", age=i)) for i in range(5)])
+            author = await adb.aget(Author, 1)
+            names = [a.name async for a in adb.aiter(Author, batch_size=2)]
+            return author, names, list(adb._dbs)
+
+    author, names, dbs = asyncio.run(main())
+
+    assert author.id == 1
+    assert sorted(names) == sorted(f"author{i}" for i in range(5))
+    assert 1 <= len(dbs) <= 2
+    for worker_db in dbs:
+        with pytest.raises(sqlite3.ProgrammingError):
+            worker_db.conn.execute("SELECT 1")
+
+
+def test_to_columns(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    lisi = Author(name="lisi", age=43)
+    wangwu = Author(name="wangwu", age=50)
+    db.save(lisi)
+    db.save(wangwu)
+    db.save(Book(title="book1", published=False, author=lisi))
+    db.save(Book(title="book2", published=True, author=wangwu))
+    db.save(Book(title="book3", published=True, author=wangwu))
+
+    authors = db.to_columns(Author, batch_size=1)
+    books = db.to_columns(Book, columns=["title", "author"], where={"author": wangwu})
+
+    assert Book._get_select_columns_sql(["title", "author"], {"published": True}) == ("SELECT title, author_id FROM book WHERE published = ?;", ["title", "author_id"], [True])
+    assert list(authors) == ["id", "age", "name"]
+    assert list(authors["age"]) == [43, 50]
+    assert list(authors["name"]) == ["lisi", "wangwu"]
+    assert list(books["title"]) == ["book2", "book3"]
+    assert list(books["author_id"]) == [2, 2]
+
+    with pytest.raises(AttributeError):
+        db.to_columns(Author, columns=["missing"])
+
+
+def test_to_columns_numpy(db, Author):
+    numpy = pytest.importorskip("numpy")
+    db.create(Author)
+    db.save(Author(name="lisi", age=43))
+    db.save(Author(name="wangwu", age=50))
+
+    columns = db.to_columns(Author, columns=["age", "name"])
+
+    assert columns["age"].dtype == numpy.int64
+    assert columns["age"].sum() == 93
+    assert list(columns["name"]) == ["lisi", "wangwu"]
+
+
+def test_query_interrupted_past_deadline(db):
+    SLOW_SQL = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n;"
+
+    class Slow(Table):
+        name = Column(str)
+
+        @classmethod
+        def _get_create_sql(cls):
+            return SLOW_SQL
+
+    started = time.monotonic()
+    with deadline(0.05):
+        with pytest.raises(DeadlineExceeded):
+            db.create(Slow)
+        with pytest.raises(DeadlineExceeded):
+            db.tables
+
+    assert time.monotonic() - started < 1
+    assert db.tables == []
+
+
+def test_reads_routed_to_replicas(tmp_path, Author):
+    primary = Database(str(tmp_path / "primary.db"))
+    primary.create(Author)
+    primary.save(Author(name="lisi", age=23))
+    primary.conn.close()
+    for name in ("replica1.db", "replica2.db"):
+        shutil.copy(tmp_path / "primary.db", tmp_path / name)
+
+    db = Database(str(tmp_path / "primary.db"), replicas=[str(tmp_path / "replica1.db"), str(tmp_path / "replica2.db")])
+    db.save(Author(name="wangwu", age=25))
+
+    assert [len(db.all(Author)) for _ in range(2)] == [1, 1]
+    assert db.get(Author, 1).name == "lisi"
+    assert db.query("SELECT count(*) FROM author") == [(2,)]
+    with pytest.raises(sqlite3.OperationalError):
+        db.replicas[0].execute("DELETE FROM author")
+
+
+def test_sharded_table(tmp_path, Author, Book):
+    db = Database(str(tmp_path / "main.db"), shards={Book: [str(tmp_path / "books0.db"), str(tmp_path / "books1.db")]})
+    db.create(Author)
+    db.create(Book)
+    lisi = Author(name="lisi", age=43)
+    db.save(lisi)
+    for i in range(5):
+        db.save(Book(title=f"book{i}", published=bool(i % 2), author=lisi))
+
+    assert "book" not in db.tables
+    assert [row[0] for row in db.shards["book"][0].execute("SELECT id FROM book ORDER BY id")] == [1, 3, 5]
+    assert [row[0] for row in db.shards["book"][1].execute("SELECT id FROM book ORDER BY id")] == [2, 4]
+    assert [book.title for book in db.all(Book)] == [f"book{i}" for i in range(5)]
+    assert [book.id for book in db.page(Book, after_id=1, limit=2)] == [2, 3]
+    assert db.get(Book, 4).author.name == "lisi"
+    assert db.get(Book, "3").title == "book2"
+
+    book = db.get(Book, 4)
+    book.title = "renamed"
+    db.update(book)
+    db.delete(Book, 5)
+
+    assert db.get(Book, 4).title == "renamed"
+    assert list(db.to_columns(Book, columns=["id"])["id"]) == [1, 3, 2, 4]
+
+
+def test_sharded_table_does_not_reuse_deleted_ids(tmp_path, Author, Book):
+    db = Database(str(tmp_path / "main.db"), shards={Book: [str(tmp_path / "books0.db"), str(tmp_path / "books1.db")]})
+    db.create(Author)
+    db.create(Book)
+    lisi = Author(name="lisi", age=43)
+    db.save(lisi)
+    for i in range(2):
+        db.save(Book(title=f"book{i}", published=False, author=lisi))
+
+    db.delete(Book, 1)
+    book = Book(title="book2", published=False, author=lisi)
+    db.save(book)
+
+    assert book.id == 3
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 1000])
+def test_to_columns_with_nulls(db, Author, batch_size):
+    db.create(Author)
+    for age in (1, 2, None, 4):
+        db.save(Author(name="author", age=age))
+
+    ages = db.to_columns(Author, columns=["age"], batch_size=batch_size)["age"]
+
+    assert list(ages) == [1, 2, None, 4]
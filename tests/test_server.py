@@ -0,0 +1,69 @@
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+import requests
+
+from sixi_web import API
+from sixi_web.server import load_app
+
+APP_MODULE = """
+from sixi_web import API
+
+app = API()
+
+
+@app.route("/hello/{name}")
+def hello(req, resp, name):
+    resp.text = f"Hello, {name}"
+"""
+
+
+def test_warmup_compiles_routes_and_templates(tmpdir_factory):
+    templates_dir = tmpdir_factory.mktemp("templates")
+    templates_dir.join("index.html").write("<h1>{{ name }}</h1>")
+    api = API(templates_dir=str(templates_dir))
+
+    @api.route("/hello/{name}")
+    def hello(req, resp, name):
+        resp.text = name
+
+    api.warmup()
+
+    assert "parser" in api.routes["/hello/{name}"]
+    assert len(api.templates_env.cache) == 1
+    assert api.test_client().get("/hello/sixi").text == "sixi"
+
+
+def test_load_app(tmp_path, monkeypatch):
+    tmp_path.joinpath("hello_app.py").write_text(APP_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    assert isinstance(load_app("hello_app:app"), API)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork server needs os.fork")
+def test_serve_with_prefork_workers(tmp_path):
+    tmp_path.joinpath("hello_app.py").write_text(APP_MODULE)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(tmp_path), os.getcwd()]))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "sixi_web", "serve", "hello_app:app", "--bind", "127.0.0.1:0", "--workers", "2", "--max-requests", "1"],
+        cwd=str(tmp_path),
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        line = ""
+        while "listening on" not in line:
+            line = proc.stderr.readline()
+            assert line, "server exited before listening"
+        url = line.split("listening on ")[1].split()[0]
+
+        for name in ("a", "b", "c"):
+            assert requests.get(f"{url}/hello/{name}", timeout=5).text == f"Hello, {name}"
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=5)
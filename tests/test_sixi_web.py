@@ -1,6 +1,15 @@
+import hashlib
+import json
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
 import pytest
 
-from sixi_web import API, Middleware
+from sixi_web import API, BackgroundTasks, Column, Database, LoadSheddingMiddleware, Middleware, Request, Table
+from sixi_web.singleflight import SingleFlight
 
 CSS_FILE_DIR = "css"
 CSS_FILE_NAME = "main.css"
@@ -236,6 +245,17 @@ def test_allowed_methods_for_function_based_views(api, client):
     assert client.post("/home").text == "testing"
 
 
+def test_head_allowed_with_get_for_function_based_views(api, client):
+    @api.route("/home", allowed_methods=["get"])
+    def home(req, resp):
+        resp.text = "testing"
+
+    resp = client.head("/home")
+    assert resp.status_code == 200
+    assert resp.text == ""
+    assert api.routes["/home"]["allowed_methods"] == ["get", "head"]
+
+
 def test_json_response(api, client):
     @api.route("/json")
     def json(req, resp):
@@ -288,3 +308,483 @@ def test_content_type_setting_response(api, client):
 
     assert "text/plain" in resp.headers["Content-Type"]
     assert resp.text == "byte"
+
+
+@pytest.fixture
+def people_db(tmp_path):
+    class Person(Table):
+        name = Column(str)
+        age = Column(int)
+
+    db = Database(str(tmp_path / "people.db"))
+    db.create(Person)
+    for i in range(5):
+        db.save(Person(name=f"person{i}", age=i))
+    return db, Person
+
+
+def test_stream_ndjson_response(api, client, people_db):
+    db, Person = people_db
+
+    @api.route("/people.ndjson")
+    def people(req, resp):
+        resp.stream_ndjson(*db.select(Person, columns=["name", "age"]), batch_size=2)
+
+    resp = client.get("/people.ndjson")
+    lines = resp.text.splitlines()
+
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+    assert len(lines) == 5
+    assert json.loads(lines[4]) == {"name": "person4", "age": 4}
+
+
+def test_stream_csv_response(api, client, people_db):
+    db, Person = people_db
+
+    @api.route("/people.csv")
+    def people(req, resp):
+        resp.stream_csv(*db.select(Person, columns=["name", "age"], where={"age": 3}))
+
+    resp = client.get("/people.csv")
+
+    assert "text/csv" in resp.headers["Content-Type"]
+    assert resp.text.splitlines() == ["name,age", "person3,3"]
+
+
+def _multipart_body(boundary, fields, files):
+    body = b""
+    for name, value in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for name, (filename, content) in files.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+        body += content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def test_multipart_upload_is_spooled_and_hashed(client):
+    api = API(spool_threshold=1024)
+    client = api.test_client()
+    content = b"\r\n--not-the-boundary" + bytes(range(256)) * 1000
+    uploads = {}
+
+    @api.route("/upload")
+    def upload(req, resp):
+        uploads.update(req.files)
+        resp.json = dict(req.form)
+
+    boundary = "sixi-boundary"
+    resp = client.post(
+        "/upload",
+        data=_multipart_body(boundary, {"title": "avatar"}, {"file": ("a.bin", content)}),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+
+    upload = uploads["file"]
+    assert resp.json() == {"title": "avatar"}
+    assert upload.filename == "a.bin"
+    assert upload.size == len(content)
+    assert upload.sha256 == hashlib.sha256(content).hexdigest()
+    assert upload.file._rolled is True
+    assert upload.read() == content
+
+
+def test_multipart_field_and_header_sizes_are_bounded():
+    api = API(spool_threshold=1024)
+    client = api.test_client()
+
+    @api.route("/upload")
+    def upload(req, resp):
+        resp.json = dict(req.form)
+
+    boundary = "sixi-boundary"
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    assert client.post("/upload", data=_multipart_body(boundary, {"title": "x" * 1024}, {}), headers=headers).json() == {"title": "x" * 1024}
+    assert client.post("/upload", data=_multipart_body(boundary, {"title": "x" * 1025}, {}), headers=headers).status_code == 413
+
+    huge_header = f"--{boundary}\r\nX-Padding: {'x' * 20000}\r\n\r\nvalue\r\n--{boundary}--\r\n".encode()
+    assert client.post("/upload", data=huge_header, headers=headers).status_code == 400
+
+
+def test_multipart_form_keeps_repeated_fields_and_consumes_body():
+    api = API()
+    client = api.test_client()
+
+    @api.route("/tags")
+    def tags(req, resp):
+        resp.json = req.form.getall("tag")
+        with pytest.raises(RuntimeError):
+            req.body
+
+    boundary = "sixi-boundary"
+    part = f'--{boundary}\r\nContent-Disposition: form-data; name="tag"\r\n\r\n{{}}\r\n'
+    body = (part.format("a") + part.format("b") + f"--{boundary}--\r\n").encode()
+    resp = client.post("/tags", data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+    assert resp.json() == ["a", "b"]
+
+
+def test_max_body_size():
+    api = API(max_body_size=10)
+    client = api.test_client()
+
+    @api.route("/echo")
+    def echo(req, resp):
+        resp.body = req.body
+
+    assert client.post("/echo", data=b"short").text == "short"
+    assert client.post("/echo", data=b"x" * 11).status_code == 413
+
+
+def test_request_json_is_cached(api, client):
+    @api.route("/json")
+    def json_view(req, resp):
+        assert req.json is req.json
+        resp.json = req.json
+
+    assert client.post("/json", json={"name": "sixi"}).json() == {"name": "sixi"}
+
+
+def test_request_json_rejects_malformed_body_and_is_writable(api, client):
+    @api.route("/json")
+    def json_view(req, resp):
+        resp.json = req.json
+
+    assert client.post("/json", data=b"{not json", headers={"Content-Type": "application/json"}).status_code == 400
+
+    req = Request.blank("/json", method="POST")
+    req.json = {"name": "sixi"}
+    assert req.json == {"name": "sixi"}
+    req.json = {"name": "changed"}
+    assert req.json == {"name": "changed"}
+
+
+def test_background_tasks_run_after_response(api):
+    events = []
+
+    @api.route("/signup")
+    def signup(req, resp):
+        resp.background(events.append, "email sent")
+        resp.text = "welcome"
+
+    app_iter = api(Request.blank("/signup").environ, lambda status, headers: events.append(status))
+    assert b"".join(app_iter) == b"welcome"
+    assert events == ["200 OK"]
+
+    app_iter.close()
+    api.shutdown()
+
+    assert events == ["200 OK", "email sent"]
+    assert api.background_tasks.stats["completed"] == 1
+
+
+def test_api_uses_given_background_tasks():
+    tasks = BackgroundTasks(workers=1, max_queue=1, policy="drop")
+    api = API(background_tasks=tasks)
+    events = []
+
+    @api.route("/signup")
+    def signup(req, resp):
+        resp.background(events.append, "email sent")
+        resp.text = "welcome"
+
+    api(Request.blank("/signup").environ, lambda status, headers: None).close()
+    api.shutdown()
+
+    assert api.background_tasks is tasks
+    assert events == ["email sent"]
+    assert tasks.stats["completed"] == 1
+
+
+def test_background_tasks_drained_at_exit():
+    code = """
+import time
+from sixi_web import BackgroundTasks
+
+def slow_print(i):
+    time.sleep(0.1)
+    print(i)
+
+tasks = BackgroundTasks(workers=1)
+for i in range(3):
+    tasks.submit(slow_print, i)
+"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=30)
+
+    assert result.stdout.split() == ["0", "1", "2"]
+
+
+def test_background_tasks_drop_policy():
+    tasks = BackgroundTasks(workers=1, max_queue=1, policy="drop")
+    release = threading.Event()
+
+    assert tasks.submit(release.wait)
+    while tasks.queue.qsize():
+        pass
+    assert tasks.submit(int)
+    assert tasks.submit(int) is False
+
+    release.set()
+    tasks.shutdown()
+    assert tasks.stats["dropped"] == 1
+    assert tasks.stats["completed"] == 2
+
+
+def test_load_shedding_rejects_over_route_limit(api, client):
+    class Limits(LoadSheddingMiddleware):
+        max_concurrency = 10
+        route_limits = {"/slow": 1}
+        retry_after = 2
+
+    limits = api.add_middleware(Limits)
+    entered, release = threading.Event(), threading.Event()
+
+    @api.route("/slow")
+    def slow(req, resp):
+        entered.set()
+        release.wait(5)
+        resp.text = "slow"
+
+    @api.route("/fast")
+    def fast(req, resp):
+        resp.text = "fast"
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(client.get("/slow")))
+    thread.start()
+    entered.wait(5)
+
+    rejected = client.get("/slow")
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "2"
+    assert client.get("/fast").text == "fast"
+    assert limits.stats()["route_in_flight"] == {"/slow": 1}
+
+    release.set()
+    thread.join()
+    assert results[0].text == "slow"
+    assert limits.stats() == {"in_flight": 0, "route_in_flight": {"/slow": 0}, "rejected": {"concurrency": 0, "route": 1, "rate": 0}}
+
+
+def test_load_shedding_rate_limit(api, client):
+    class Limits(LoadSheddingMiddleware):
+        rate = 0.5
+        burst = 2
+        rate_limit_header = "X-Api-Key"
+
+    api.add_middleware(Limits)
+
+    @api.route("/")
+    def index(req, resp):
+        resp.text = "ok"
+
+    assert [client.get("/", headers={"X-Api-Key": "a"}).status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get("/", headers={"X-Api-Key": "b"}).status_code == 200
+    assert client.get("/", headers={"X-Api-Key": "a"}).headers["Retry-After"] == "2"
+
+
+def test_load_shedding_holds_slot_until_stream_closed(api, people_db):
+    db, Person = people_db
+
+    class Limits(LoadSheddingMiddleware):
+        max_concurrency = 1
+        route_limits = {"/people.ndjson": 1}
+
+    limits = api.add_middleware(Limits)
+    matches = []
+    find_view_and_kwargs = api.find_view_and_kwargs
+    api.find_view_and_kwargs = lambda path: matches.append(path) or find_view_and_kwargs(path)
+
+    @api.route("/people.ndjson")
+    def people(req, resp):
+        resp.stream_ndjson(*db.select(Person, columns=["name"]), batch_size=2)
+
+    statuses = []
+    app_iter = api(Request.blank("/people.ndjson").environ, lambda status, headers: statuses.append(status))
+    assert limits.stats()["route_in_flight"] == {"/people.ndjson": 1}
+    api(Request.blank("/people.ndjson").environ, lambda status, headers: statuses.append(status))
+    assert statuses == ["200 OK", "503 Service Unavailable"]
+    assert b"".join(app_iter).count(b"\n") == 5
+
+    app_iter.close()
+    assert limits.stats()["in_flight"] == 0
+    assert matches == ["/people.ndjson", "/people.ndjson"]
+
+
+def test_load_shedding_rate_limit_keys_on_peer_address(api):
+    class Limits(LoadSheddingMiddleware):
+        rate = 0.01
+        burst = 1
+        rate_limit_header = "X-Api-Key"
+
+    api.add_middleware(Limits)
+
+    @api.route("/")
+    def index(req, resp):
+        resp.text = "ok"
+
+    def status(remote_addr, headers):
+        statuses = []
+        api(Request.blank("/", environ={"REMOTE_ADDR": remote_addr}, headers=headers).environ, lambda status, headers: statuses.append(status))
+        return statuses[0]
+
+    assert status("10.0.0.1", {"X-Forwarded-For": "1.1.1.1"}) == "200 OK"
+    assert status("10.0.0.1", {"X-Forwarded-For": "2.2.2.2"}).startswith("429")
+    assert status("10.0.0.2", {}) == "200 OK"
+    assert status("10.0.0.2", {}).startswith("429")
+
+
+def test_coalesced_route_runs_view_once(api, client):
+    calls = []
+    entered, release = threading.Event(), threading.Event()
+
+    @api.route("/popular", coalesce=True)
+    def popular(req, resp):
+        calls.append(req.path_qs)
+        entered.set()
+        release.wait(5)
+        resp.json = {"calls": len(calls)}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(client.get("/popular").json()))
+    leader.start()
+    entered.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(client.get("/popular").json())) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert calls == ["/popular"]
+    assert results == [{"calls": 1}] * 5
+    assert client.get("/popular").json() == {"calls": 2}
+
+
+def test_coalesce_key_includes_vary_headers():
+    req = Request.blank("/popular?page=2", headers={"Accept-Language": "en"})
+
+    assert SingleFlight.key(req) == ("GET", "/popular?page=2")
+    assert SingleFlight.key(req, ("Accept-Language",)) == ("GET", "/popular?page=2", "en")
+
+
+def test_auto_etag_not_modified(api, client):
+    @api.route("/json")
+    def json_view(req, resp):
+        resp.json = dict(name="sixi")
+
+    resp = client.get("/json")
+    etag = resp.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    not_modified = client.get("/json", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert client.get("/json", headers={"If-None-Match": 'W/"other"'}).status_code == 200
+
+
+def test_handler_etag_skips_deferred_rendering(api, client):
+    rendered = []
+
+    def render(resp):
+        rendered.append(True)
+        resp.json = dict(name="sixi")
+
+    @api.route("/author")
+    def author(req, resp):
+        resp.etag = "author-1-v3"
+        resp.last_modified = datetime(2024, 1, 1, 12, 0, 0)
+        resp.defer(render)
+
+    assert client.get("/author", headers={"If-None-Match": '"author-1-v3"'}).status_code == 304
+    assert client.get("/author", headers={"If-Modified-Since": "Mon, 01 Jan 2024 12:00:00 GMT"}).status_code == 304
+    head = client.head("/author")
+    assert head.status_code == 200
+    assert head.headers["ETag"] == '"author-1-v3"'
+    assert head.headers["Last-Modified"] == "Mon, 01 Jan 2024 12:00:00 GMT"
+    assert rendered == []
+
+    resp = client.get("/author", headers={"If-Modified-Since": "Sun, 31 Dec 2023 12:00:00 GMT"})
+    assert resp.json() == {"name": "sixi"}
+    assert rendered == [True]
+
+
+def test_head_falls_back_to_get_for_class_based_views(api, client):
+    @api.route("/todo")
+    class TodoResource:
+        def get(self, req, resp):
+            resp.text = "todo"
+
+    resp = client.head("/todo")
+    assert resp.status_code == 200
+    assert resp.content == b""
+
+
+def test_request_deadline_returns_504(tmp_path):
+    api = API(timeout=10)
+    client = api.test_client()
+    db = Database(str(tmp_path / "slow.db"))
+
+    @api.route("/slow", timeout=0.05)
+    def slow(req, resp):
+        resp.json = db.query("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n;")
+
+    @api.route("/fast")
+    def fast(req, resp):
+        resp.json = db.tables
+
+    @api.route("/budget")
+    def budget(req, resp):
+        resp.text = "ok"
+
+    started = time.monotonic()
+    assert client.get("/slow").status_code == 504
+    assert time.monotonic() - started < 1
+    assert client.get("/fast").status_code == 200
+    assert client.get("/budget").status_code == 200
+
+    stats = api.deadline_stats.stats()
+    assert stats["requests"] == 3
+    assert stats["exceeded"] == 1
+    assert stats["min_remaining"] <= 0
+
+
+def test_mount_sub_api(api, client):
+    admin = API()
+
+    @admin.route("/users/{name}")
+    def user(req, resp, name):
+        resp.json = {"name": name, "script_name": req.script_name, "path_info": req.path_info}
+
+    @admin.error_handler(AttributeError)
+    def admin_error_handler(req, resp, error):
+        resp.text = "admin error"
+
+    @admin.route("/")
+    def admin_index(req, resp):
+        raise AttributeError("boom")
+
+    @api.route("/users/{name}")
+    def site_user(req, resp, name):
+        resp.text = f"site {name}"
+
+    api.mount("/admin", admin)
+
+    assert client.get("/admin/users/kada").json() == {"name": "kada", "script_name": "/admin", "path_info": "/users/kada"}
+    assert client.get("/admin").text == "admin error"
+    assert client.get("/users/kada").text == "site kada"
+    assert client.get("/administrator/users/kada").status_code == 404
+
+
+def test_mount_wsgi_app(api, client):
+    def legacy(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [f"{environ['SCRIPT_NAME']}|{environ['PATH_INFO']}".encode()]
+
+    api.mount("/legacy", legacy)
+
+    assert client.get("/legacy/a/b").text == "/legacy|/a/b"
+    with pytest.raises(AssertionError):
+        api.mount("legacy/", legacy)
+    with pytest.raises(ValueError):
+        api.mount("/a/b", legacy)
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.environ.get("SIXI_WEB_IMPORT_BUDGET_MS", 250))
+LAZY_MODULES = ("jinja2", "whitenoise", "requests", "wsgiadapter", "sqlite3", "sixi_web.orm")
+
+
+def _import_sixi_web(code=""):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sixi_web, sys\n{code}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout, result.stderr
+
+
+def _cumulative_import_us(importtime_output, module):
+    for line in importtime_output.splitlines():
+        _, _, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|").split("|"))
+        if name == module:
+            return int(cumulative_us)
+    raise AssertionError(f"{module} missing from -X importtime output")
+
+
+def test_optional_dependencies_are_imported_lazily():
+    stdout, _ = _import_sixi_web(f"print(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+
+    assert stdout.strip() == "[]"
+
+
+def test_lazy_orm_attributes():
+    stdout, _ = _import_sixi_web("print(sixi_web.Database.__module__)")
+
+    assert stdout.strip() == "sixi_web.orm"
+
+
+def test_import_time_budget():
+    _import_sixi_web()  # warm the bytecode cache
+    timings = [_cumulative_import_us(_import_sixi_web()[1], "sixi_web") for _ in range(3)]
+
+    assert min(timings) / 1000 < IMPORT_BUDGET_MS, f"import sixi_web took {min(timings) / 1000:.1f}ms, budget {IMPORT_BUDGET_MS}ms"